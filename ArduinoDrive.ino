@@ -16,9 +16,13 @@ struct FileMeta {
 
 FileMeta files[FILE_COUNT];
 
+//state of a chunked WRITE_BEGIN/CHUNK/END transfer
+int writeIndex = -1;
+int writePos = 0;
+
 void setup() {
   //configure serial
-  Serial.begin(9600);
+  Serial.begin(250000); //must match BAUD in gui.py
   loadMetadata();
 }
 
@@ -39,6 +43,7 @@ void loadMetadata() {
     }
     files[i].name[9] = '\0';  //Null terminate the name
     files[i].length = EEPROM.read(addr + 10) | (EEPROM.read(addr + 11) << 8);
+    if (files[i].length > FILE_SIZE) files[i].length = FILE_SIZE; //unformatted eeprom reads 0xFFFF
   }
 }
 
@@ -58,15 +63,16 @@ void saveMetadata() {
 
 void handleCommand(String cmd) {
   cmd.trim();
+  bool ok = true;
   
   if (cmd.startsWith("WRITE ")) {
     int fileIndex = cmd.substring(6, 7).toInt() - 1;
     String data = cmd.substring(8);
-    writeFile(fileIndex, data);
+    ok = writeFile(fileIndex, data);
 
   } else if (cmd.startsWith("READ ")) {
     int fileIndex = cmd.substring(5).toInt() - 1;
-    readFile(fileIndex);
+    ok = readFile(fileIndex);
 
   } else if (cmd.startsWith("LIST")) {
     for (int i = 0; i < FILE_COUNT; i++) {
@@ -78,30 +84,65 @@ void handleCommand(String cmd) {
       Serial.println(" bytes)");
     }
 
+  } else if (cmd.startsWith("STATE")) {
+    //tab separated: index, name, length, crc of the stored bytes
+    for (int i = 0; i < FILE_COUNT; i++) {
+      Serial.print(i + 1);
+      Serial.print('\t');
+      Serial.print(files[i].name);
+      Serial.print('\t');
+      Serial.print(files[i].length);
+      Serial.print('\t');
+      Serial.println(fileCrc(i), HEX);
+    }
+
   } else if (cmd.startsWith("WRITE_NAME ")) {
     int fileIndex = cmd.substring(11, 12).toInt() - 1;
     String newName = cmd.substring(13);
     newName.trim();
-    if (newName.length() > 9) newName = newName.substring(0, 9); //last char for null terminating
-    for (int i = 0; i < 9; i++) {
-      files[fileIndex].name[i] = i < newName.length() ? newName[i] : 0;
+    if (fileIndex < 0 || fileIndex >= FILE_COUNT) {
+      ok = false;
+    } else {
+      if (newName.length() > 9) newName = newName.substring(0, 9); //last char for null terminating
+      for (int i = 0; i < 9; i++) {
+        files[fileIndex].name[i] = i < newName.length() ? newName[i] : 0;
+      }
+      files[fileIndex].name[9] = '\0';
+      saveMetadata();
     }
-    files[fileIndex].name[9] = '\0';
-    saveMetadata();
+
+  } else if (cmd.startsWith("WRITE_BEGIN ")) {
+    int fileIndex = cmd.substring(12).toInt() - 1;
+    ok = beginWrite(fileIndex);
+
+  } else if (cmd.startsWith("CHUNK ")) {
+    ok = writeChunk(cmd.substring(6));
+
+  } else if (cmd == "END") {
+    ok = endWrite();
+
+  } else if (cmd == "ABORT") {
+    abortWrite();
 
   } else if (cmd.startsWith("DELETE")) {
     int fileIndex = cmd.substring(7).toInt() - 1;
-    deleteFile(fileIndex);
+    ok = deleteFile(fileIndex);
 
   } else if (cmd.startsWith("FORMAT")) {
     formatEEPROM();
     Serial.println("EEPROM formatted. All files cleared.");
+
+  } else {
+    ok = false;
   }
+
+  //every reply ends with a status line so the host can stop reading right away
+  Serial.println(ok ? "OK" : "ERROR");
 }
 
 
-void writeFile(int index, String data) {
-  if (index < 0 || index >= FILE_COUNT) return;
+bool writeFile(int index, String data) {
+  if (index < 0 || index >= FILE_COUNT) return false;
   if (data.length() > FILE_SIZE) data = data.substring(0, FILE_SIZE);
 
   int addr = index * FILE_SIZE;
@@ -110,21 +151,89 @@ void writeFile(int index, String data) {
   }
   files[index].length = data.length();
   saveMetadata();
+  return true;
+}
+
+
+bool beginWrite(int index) {
+  //host sends the file as short hex CHUNK lines so no line overruns the 64 byte rx buffer
+  if (index < 0 || index >= FILE_COUNT) return false;
+  abortWrite(); //a transfer the host never finished
+  writeIndex = index;
+  writePos = 0;
+  return true;
+}
+
+
+void abortWrite() {
+  //the slot is already partly overwritten, so empty it rather than mix old and new bytes
+  if (writeIndex < 0) return;
+  files[writeIndex].length = 0;
+  saveMetadata();
+  writeIndex = -1;
 }
 
 
-void readFile(int index) {
-  if (index < 0 || index >= FILE_COUNT) return;
+int hexValue(char c) {
+  if (c >= '0' && c <= '9') return c - '0';
+  if (c >= 'a' && c <= 'f') return c - 'a' + 10;
+  if (c >= 'A' && c <= 'F') return c - 'A' + 10;
+  return -1;
+}
+
+
+bool writeChunk(String hex) {
+  if (writeIndex < 0 || hex.length() % 2) return false;
+
+  int addr = writeIndex * FILE_SIZE;
+  for (int i = 0; i < hex.length(); i += 2) {
+    int hi = hexValue(hex[i]);
+    int lo = hexValue(hex[i + 1]);
+    if (hi < 0 || lo < 0) return false;
+    if (writePos < FILE_SIZE) EEPROM.write(addr + writePos++, (hi << 4) | lo);
+  }
+  return true;
+}
+
+
+bool endWrite() {
+  if (writeIndex < 0) return false;
+  files[writeIndex].length = writePos;
+  saveMetadata();
+  writeIndex = -1;
+  return true;
+}
+
+
+bool readFile(int index) {
+  if (index < 0 || index >= FILE_COUNT) return false;
 
   int addr = index * FILE_SIZE;
+  Serial.print('>'); //marks the payload line so it never looks like a status line
   for (int i = 0; i < files[index].length; i++) {
     Serial.write(EEPROM.read(addr + i));
   }
+  Serial.println(); //payload is escaped, so this newline always ends it
+  return true;
+}
+
+
+uint16_t fileCrc(int index) {
+  //CRC-CCITT (poly 0x1021, init 0xFFFF), matches python's binascii.crc_hqx(data, 0xFFFF)
+  uint16_t crc = 0xFFFF;
+  int addr = index * FILE_SIZE;
+  for (int i = 0; i < files[index].length; i++) {
+    crc ^= (uint16_t)EEPROM.read(addr + i) << 8;
+    for (int b = 0; b < 8; b++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
 }
 
 
-void deleteFile(int index) {
-  if (index < 0 || index >= FILE_COUNT) return;
+bool deleteFile(int index) {
+  if (index < 0 || index >= FILE_COUNT) return false;
 
   int addr = index * FILE_SIZE;
   for (int i = 0; i < FILE_SIZE; i++) {
@@ -135,6 +244,7 @@ void deleteFile(int index) {
     files[index].name[i] = 0;
   }
   saveMetadata();
+  return true;
 }
 
 
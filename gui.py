@@ -9,69 +9,153 @@ from tkinter import ttk, simpledialog, messagebox
 from tkinter.scrolledtext import ScrolledText
 import serial
 import time
+import re
+import binascii
+import threading
+import queue
 
 #Config
 PORT_DEFAULT = "COM9"
-BAUD = 9600
+BAUD = 250000 #must match Serial.begin in ArduinoDrive.ino
 FILE_COUNT = 3
 READ_TIMEOUT = 0.5
+SLOW_TIMEOUT = 2.0 #DELETE rewrites 300 eeprom bytes at ~3.3 ms each, STATE checksums every file
+SLOW_CMDS = (b'DELETE', b'STATE')
+REPLY_END = (b'OK', b'ERROR')
 
 #Utilities
+_ESCAPE_TABLE = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r'})
+_UNESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+_UNESCAPE_MAP = {'n': '\n', 'r': '\r', '\\': '\\'}
+_STATE_RE = re.compile(r'^(\d+)\t([^\t]*)\t(\d+)\t([0-9A-Fa-f]+)$')
+_NAME_RE = re.compile(r'[A-Za-z0-9_.-]{1,9}')
+_TEXT_DELETE = bytes(x for x in range(256) if not (32 <= x <= 126 or x == 10))
+#wire form of every fixed command, built once
+_CMD = {'STATE': b'STATE\n',
+        **{(op, i): f'{op} {i}\n'.encode() for op in ('READ', 'DELETE') for i in range(1, FILE_COUNT + 1)}}
+
 def escape_for_arduino(s: str) -> str:
-    s = s.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
-    return s
+    return s.translate(_ESCAPE_TABLE)
 
 def unescape_from_arduino(s: str) -> str:
-    out, i = [], 0
-    while i < len(s):
-        if s[i] == '\\' and i + 1 < len(s):
-            nxt = s[i + 1]
-            if nxt == 'n': out.append('\n')
-            elif nxt == 'r': out.append('\r')
-            elif nxt == '\\': out.append('\\')
-            else: out.append(nxt)
-            i += 2
-        else:
-            out.append(s[i])
-            i += 1
-    return ''.join(out)
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPE_MAP.get(m.group(1), m.group(1)), s)
 
 def bytes_to_text(b: bytes) -> str:
-    return ''.join(chr(x) if 32 <= x <= 126 or x in (10,) else '' for x in b)
+    return b.translate(None, _TEXT_DELETE).decode('ascii')
+
+def file_crc(data: bytes) -> int:
+    #CRC-CCITT (poly 0x1021, init 0xFFFF), same as fileCrc in the sketch
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def parse_state(raw: bytes) -> dict:
+    #not bytes_to_text, that would strip the tab separators
+    lines = raw.decode('ascii', 'replace').splitlines()
+    return {int(m.group(1)): (m.group(2) or "(empty)", int(m.group(3)), int(m.group(4), 16))
+            for ln in lines if (m := _STATE_RE.match(ln.strip()))}
 
 #Serial Client
 class SerialClient:
-    def __init__(self, port=PORT_DEFAULT, baud=BAUD, timeout=0.1):
+    def __init__(self, port=PORT_DEFAULT, baud=BAUD, timeout=READ_TIMEOUT):
         self.port = port
         self.baud = baud
         self.timeout = timeout
         self.ser = None
+        self._rx = bytearray()
+        self._lock = threading.RLock()
 
     def connect(self):
-        if self.ser:
-            self.close()
-        self.ser = serial.Serial(self.port, self.baud, timeout=self.timeout)
-        time.sleep(0.15)
-        self.ser.reset_input_buffer()
+        with self._lock:
+            if self.is_open():
+                self.ser.close()
+            #write_timeout keeps a hung board from blocking the worker thread forever
+            self.ser = serial.Serial(self.port, self.baud, timeout=self.timeout,
+                                     exclusive=True, write_timeout=0.2)
+            #only available on Windows, where the default driver buffers are small
+            if hasattr(self.ser, "set_buffer_size"):
+                self.ser.set_buffer_size(rx_size=65536, tx_size=65536)
+            time.sleep(0.15)
+            self.resync()
+
+    def resync(self, quiet=0.0):
+        #drop anything left over from before, e.g. a reset banner or a timed out reply.
+        #with quiet set, keep draining until nothing arrived for that long, since a
+        #late reply is still on its way and would otherwise answer the next command
+        with self._lock:
+            if not self.is_open(): return
+            self.ser.reset_input_buffer()
+            last = time.monotonic()
+            while time.monotonic() - last < quiet:
+                if self.ser.read(self.ser.in_waiting or 1): last = time.monotonic()
+            self.ser.read(self.ser.in_waiting)
+            self._rx.clear()
 
     def close(self):
-        if self.ser and self.ser.is_open:
-            self.ser.close()
-        self.ser = None
+        with self._lock:
+            try:
+                if self.ser and self.ser.is_open:
+                    self.ser.close()
+            finally:
+                self.ser = None
 
     def is_open(self):
         return self.ser is not None and self.ser.is_open
 
     def send_line(self, line: str) -> bytes:
-        if not self.is_open(): return b''
-        self.ser.reset_input_buffer()
-        self.ser.write((line + '\n').encode('utf-8', errors='ignore'))
-        buf, start = b'', time.time()
-        while time.time() - start < READ_TIMEOUT:
-            avail = self.ser.in_waiting
-            if avail: buf += self.ser.read(avail)
-            else: time.sleep(0.01)
-        return buf
+        return self.send_bytes((line + '\n').encode('utf-8', errors='ignore'))
+
+    def send_bytes(self, raw: bytes) -> bytes:
+        #None (not b'') when the port is closed, so callers can tell it never ran
+        with self._lock:
+            if not self.is_open(): return None
+            return self._transact(raw)[0]
+
+    def send_chunked(self, prefix: str, payload: bytes, chunk=16) -> bool:
+        #hex keeps every CHUNK line well under the arduino's 64 byte rx buffer,
+        #and waiting for each status line lets the sketch finish its eeprom writes
+        with self._lock:
+            if not self.is_open(): return None
+            if not self._transact((prefix + '\n').encode())[1]: return False
+            try:
+                for i in range(0, len(payload), chunk):
+                    if not self._transact(b'CHUNK ' + payload[i:i + chunk].hex().encode() + b'\n')[1]:
+                        #empties the half written slot instead of leaving old and new bytes mixed
+                        self._transact(b'ABORT\n')
+                        return False
+            except Exception:
+                #e.g. a write timeout mid transfer, still try to abort before reporting it
+                try: self._transact(b'ABORT\n')
+                except Exception: pass
+                raise
+            return self._transact(b'END\n')[1]
+
+    def _transact(self, raw: bytes):
+        self.ser.write(raw)
+        timeout = SLOW_TIMEOUT if raw.startswith(SLOW_CMDS) else self.timeout
+        #read line by line until the OK/ERROR status line, an empty read means timeout
+        buf, ok = bytearray(), False
+        while True:
+            ln = self._read_line(timeout)
+            if not ln:
+                #no status line in time, wait out the late reply so it can't answer the next command
+                self.resync(quiet=SLOW_TIMEOUT)
+                break
+            if ln.strip() in REPLY_END:
+                ok = ln.strip() == b'OK'
+                break
+            buf.extend(ln)
+        return bytes(buf), ok
+
+    def _read_line(self, timeout) -> bytes:
+        #read() waits in select (posix) or WaitCommEvent (windows) until data arrives,
+        #then take everything already waiting instead of one byte per call
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._rx and time.monotonic() < deadline:
+            #an empty read only means the port timeout passed, keep going until the deadline
+            self._rx.extend(self.ser.read(self.ser.in_waiting or 1))
+        end = self._rx.find(b'\n') + 1 or len(self._rx)
+        ln = bytes(self._rx[:end])
+        del self._rx[:end]
+        return ln
 
 #GUI
 class ModernEEPROM(tk.Tk):
@@ -88,6 +172,15 @@ class ModernEEPROM(tk.Tk):
         self.configure(bg=self.BG)
 
         self.client = SerialClient(PORT_DEFAULT)
+        #serial I/O runs on a worker thread, results come back through _drain_resp
+        self._cmd_q = queue.Queue()
+        self._resp_q = queue.Queue()
+        threading.Thread(target=self._serial_worker, daemon=True).start()
+        self.after(20, self._drain_resp)
+        self._refresh_after = None
+        self._last_list_sig = None
+        self._slot_crc = {}
+        self._read_cache = {} #idx -> (crc, text) of the last READ
         self._build_style()
         self._build_ui()
         try:
@@ -124,6 +217,9 @@ class ModernEEPROM(tk.Tk):
         ttk.Label(top, text="Port:").pack(side='left')
         self.port_var = tk.StringVar(value=PORT_DEFAULT)
         ttk.Entry(top, textvariable=self.port_var, width=10).pack(side='left', padx=6)
+        ttk.Label(top, text="Baud:").pack(side='left')
+        self.baud_var = tk.StringVar(value=str(BAUD))
+        ttk.Entry(top, textvariable=self.baud_var, width=8).pack(side='left', padx=6)
         self.btn_connect = ttk.Button(top, text="Connect", command=self.toggle_connect)
         self.btn_connect.pack(side='left')
         ttk.Button(top, text="Refresh", command=self.refresh_files).pack(side='left', padx=6)
@@ -178,17 +274,27 @@ class ModernEEPROM(tk.Tk):
     #Connection
     def toggle_connect(self):
         if self.client.is_open():
-            self.client.close()
-            self.btn_connect.config(text="Connect")
-            self._set_status("Disconnected")
+            #close on the worker, after whatever write or delete is still running
+            self.btn_connect.config(state='disabled')
+            self._set_status("Disconnecting…")
+            self._enqueue(None, self._on_disconnected, send=self._close_client)
         else:
             port = self.port_var.get().strip()
             if not port:
                 messagebox.showwarning("Port required", "Enter serial port")
                 return
+            try:
+                baud = int(self.baud_var.get().strip())
+            except ValueError:
+                messagebox.showwarning("Baud required", "Enter a numeric baud rate")
+                return
             self.client.port = port
+            self.client.baud = baud
             try:
                 self.client.connect()
+                self._last_list_sig = None
+                self._read_cache.clear()
+                self._slot_crc.clear()
                 self._set_status(f"Connected {port}")
                 self.btn_connect.config(text="Disconnect")
                 self.refresh_files()
@@ -196,27 +302,72 @@ class ModernEEPROM(tk.Tk):
                 messagebox.showerror("Failed", f"Could not open {port}\n{e}")
                 self._set_status("Not connected")
 
+    def _close_client(self, _):
+        self.client.close()
+        return True
+
+    def _on_disconnected(self, _):
+        self.btn_connect.config(text="Connect", state='normal')
+        self._set_status("Disconnected")
+
+    #Serial worker
+    def _serial_worker(self):
+        while True:
+            send, arg, cb = self._cmd_q.get()
+            try:
+                result = send(arg)
+            except (serial.SerialException, OSError) as e:
+                self._resp_q.put((self._set_status, f"Serial error: {e}"))
+                continue
+            except Exception as e:
+                #keep the worker alive, a dead thread would silently stall every command
+                self._resp_q.put((self._set_status, f"Error: {e}"))
+                continue
+            #None means the port was closed before the command ran
+            if cb and result is not None: self._resp_q.put((cb, result))
+
+    def _drain_resp(self):
+        #runs on the Tk thread, so callbacks may touch widgets
+        try:
+            while True:
+                cb, result = self._resp_q.get_nowait()
+                cb(result)
+        except queue.Empty:
+            pass
+        finally:
+            #reschedule even if a callback raised, tk still reports the error
+            self.after(20, self._drain_resp)
+
+    def _enqueue(self, cmd, callback=None, send=None):
+        self._cmd_q.put((send or self.client.send_line, cmd, callback))
+
     #File Operations
     def refresh_files(self):
+        #coalesce bursts of refresh requests into a single LIST
+        if self._refresh_after: self.after_cancel(self._refresh_after)
+        self._refresh_after = self.after(150, self._do_refresh)
+
+    def _do_refresh(self):
+        self._refresh_after = None
         if not self.client.is_open():
             return
-        raw = self.client.send_line("LIST")
-        txt = bytes_to_text(raw)
-        lines = [ln.strip() for ln in txt.splitlines() if ln.strip()]
-        self.tree.delete(*self.tree.get_children())
-        for i in range(FILE_COUNT):
-            label = f"(empty)"
-            size = 0
-            for ln in lines:
-                if ln.startswith(f"{i+1}:"):
-                    try:
-                        name = ln.split(':',1)[1].split('(')[0].strip()
-                        s = int(ln.split('(')[1].split()[0])
-                        label = name
-                        size = s
-                    except: pass
-                    break
-            self.tree.insert('', 'end', iid=str(i+1), values=(label, f"{size} B"))
+        self._enqueue(_CMD['STATE'], self._show_files, send=self.client.send_bytes)
+
+    def _show_files(self, raw):
+        parsed = parse_state(raw)
+        self._slot_crc = {i: crc for i, (_, _, crc) in parsed.items()}
+        #skip all widget work when the listing hasn't changed
+        sig = tuple(sorted(parsed.items()))
+        if sig == self._last_list_sig: return
+        self._last_list_sig = sig
+        sel = self.tree.selection()
+        for i in range(1, FILE_COUNT + 1):
+            name, size, _ = parsed.get(i, ("(empty)", 0, None))
+            values = (name, f"{size} B")
+            #update existing rows in place instead of rebuilding the whole tree
+            if self.tree.exists(str(i)): self.tree.item(str(i), values=values)
+            else: self.tree.insert('', 'end', iid=str(i), values=values)
+        if sel: self.tree.selection_set(sel)
 
     def _get_selected_index(self):
         sel = self.tree.selection()
@@ -226,8 +377,25 @@ class ModernEEPROM(tk.Tk):
     def read_selected(self):
         idx = self._get_selected_index()
         if idx is None or not self.client.is_open(): return
-        raw = self.client.send_line(f"READ {idx}")
-        text = unescape_from_arduino(bytes_to_text(raw))
+        #the last STATE reply says whether the copy from the previous READ is still current
+        cached = self._read_cache.get(idx)
+        if cached and cached[0] == self._slot_crc.get(idx):
+            self._show_text(idx, cached[1])
+            self._set_status(f"Read file {idx} (cached)")
+            return
+        #show progress right away, the callbacks report completion
+        self._set_status(f"Reading file {idx}…")
+        self._enqueue(_CMD['READ', idx], lambda raw: self._show_file(idx, raw), send=self.client.send_bytes)
+
+    def _show_file(self, idx, raw):
+        text = unescape_from_arduino(bytes_to_text(raw).rstrip('\n').removeprefix('>'))
+        #crc of the bytes as stored, comparable with the STATE reply
+        crc = file_crc(raw.rstrip(b'\r\n').removeprefix(b'>'))
+        self._read_cache[idx] = (crc, text)
+        self._show_text(idx, text)
+        self._set_status(f"Read file {idx}")
+
+    def _show_text(self, idx, text):
         self.editor.delete('1.0','end')
         self.editor.insert('1.0', text)
         try: name = self.tree.set(str(idx), 'name'); self.filename_label.config(text=f"{idx}: {name}")
@@ -236,30 +404,55 @@ class ModernEEPROM(tk.Tk):
     def write_selected(self):
         idx = self._get_selected_index()
         if idx is None or not self.client.is_open(): return
-        text = self.editor.get('1.0','end').rstrip('\n')
-        escaped = escape_for_arduino(text)
-        self.client.send_line(f"WRITE {idx} {escaped}")
-        time.sleep(0.02)
-        self._set_status(f"Wrote file {idx}")
-        self.refresh_files()
+        #end-1c leaves out only tk's own trailing newline, so an unedited file compares equal
+        text = self.editor.get('1.0','end-1c')
+        payload = escape_for_arduino(text).encode('utf-8', errors='ignore')
+        #identical contents would only burn eeprom write cycles
+        crc = file_crc(payload)
+        if crc == self._slot_crc.get(idx):
+            self._set_status(f"No change to file {idx}")
+            return
+        #until the write finishes the board's crc is unknown, so nothing may match it
+        self._slot_crc.pop(idx, None)
+        self._set_status(f"Writing file {idx}…")
+        self._enqueue(payload, lambda ok: self._after_write(idx, crc, text, ok),
+                      send=lambda payload: self.client.send_chunked(f"WRITE_BEGIN {idx}", payload))
+
+    def _after_write(self, idx, crc, text, ok):
+        #the next STATE reply confirms the crc, so a truncated write just misses the cache
+        if ok:
+            self._slot_crc[idx] = crc
+            self._read_cache[idx] = (crc, text)
+        self._after_change(f"Wrote file {idx}" if ok else f"Write to file {idx} failed")
 
     def rename_selected(self):
         idx = self._get_selected_index()
         if idx is None or not self.client.is_open(): return
         newname = simpledialog.askstring("Rename", "New filename (max 9 chars)")
         if not newname: return
-        self.client.send_line(f"WRITE_NAME {idx} {newname[:9]}")
-        time.sleep(0.02)
-        self._set_status(f"Renamed file {idx}")
-        self.refresh_files()
+        newname = newname.strip()
+        #check locally, the sketch silently mangles names it can't store
+        if not _NAME_RE.fullmatch(newname):
+            messagebox.showerror("Invalid", "Name must be 1-9 chars, alnum/._-")
+            return
+        if newname == self.tree.set(str(idx), 'name'): return
+        self._set_status(f"Renaming file {idx}…")
+        self._enqueue(f"WRITE_NAME {idx} {newname}", lambda _: self._after_change(f"Renamed file {idx}"))
 
     def delete_selected(self):
         idx = self._get_selected_index()
         if idx is None or not self.client.is_open(): return
         if not messagebox.askyesno("Delete", f"Delete file {idx}?"): return
-        self.client.send_line(f"DELETE {idx}")
         self.editor.delete('1.0','end')
-        self._set_status(f"Deleted file {idx}")
+        #forget the old contents now, the next STATE is over a second away
+        self._read_cache.pop(idx, None)
+        self._slot_crc.pop(idx, None)
+        self._set_status(f"Deleting file {idx}…")
+        self._enqueue(_CMD['DELETE', idx], lambda _: self._after_change(f"Deleted file {idx}"),
+                      send=self.client.send_bytes)
+
+    def _after_change(self, status):
+        self._set_status(status)
         self.refresh_files()
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("serial")
+import gui
+
+
+def test_parse_state_reply():
+    raw = b'1\tnotes\t5\tABCD\r\n2\t\t0\tFFFF\r\n3\tlog.txt\t12\t1f\r\n'
+    assert gui.parse_state(raw) == {
+        1: ("notes", 5, 0xABCD),
+        2: ("(empty)", 0, 0xFFFF),
+        3: ("log.txt", 12, 0x1F),
+    }
+
+
+def test_parse_state_skips_stray_lines():
+    assert gui.parse_state(b'OK\r\n>junk\r\n2\tx\t1\t0\r\n') == {2: ("x", 1, 0)}
+
+
+def sketch_crc(data):
+    #bit-by-bit port of fileCrc() in ArduinoDrive.ino
+    crc = 0xFFFF
+    for b in data:
+        crc ^= b << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+    return crc
+
+
+def make_app(text, slot_crc):
+    app = SimpleNamespace(
+        _get_selected_index=lambda: 1,
+        client=SimpleNamespace(is_open=lambda: True),
+        editor=SimpleNamespace(get=lambda *_: app.text),
+        text=text,
+        _slot_crc=slot_crc,
+        _read_cache={},
+        status=[],
+        sent=[],
+        _after_change=lambda msg: app.status.append(msg),
+    )
+    app._set_status = app.status.append
+    app._enqueue = lambda payload, cb, **kw: app.sent.append((payload, cb))
+    app._after_write = lambda *a: gui.ModernEEPROM._after_write(app, *a)
+    return app
+
+
+def test_unedited_write_is_skipped():
+    text = "line one\nback\\slash\r\n"
+    stored = gui.escape_for_arduino(text).encode()
+    state = f"1\tnotes\t{len(stored)}\t{sketch_crc(stored):X}\r\n".encode()
+
+    app = make_app(text, {i: crc for i, (_, _, crc) in gui.parse_state(state).items()})
+    gui.ModernEEPROM.write_selected(app)
+    assert app.sent == []
+    assert app.status == ["No change to file 1"]
+
+
+def test_write_back_before_state_is_not_skipped():
+    stored = gui.escape_for_arduino("A").encode()
+    app = make_app("B", {1: sketch_crc(stored)})
+
+    gui.ModernEEPROM.write_selected(app)
+    app.sent[0][1](True)  #B written, its STATE reply not in yet
+    app.text = "A"
+    gui.ModernEEPROM.write_selected(app)
+
+    assert [payload for payload, _ in app.sent] == [b"B", b"A"]
+    assert "No change to file 1" not in app.status